@@ -1,8 +1,14 @@
 import streamlit as st
 import streamlit.components.v1 as components
-import random
+import json
+import numpy as np
+import string
 import time
-import math
+
+from traffic_core import (
+    PHASE_NAMES, MAINTAIN, SUGGESTION_NAMES,
+    POSITIONS, Params, step, render, build_schedule,
+)
 
 # -------------------- PAGE CONFIG --------------------
 st.set_page_config(page_title="Traffic Optimizer – Objective 2", layout="wide")
@@ -18,183 +24,183 @@ init_speed = st.sidebar.slider("Initial Speed (km/h)", 10, 60, 25)
 max_speed = st.sidebar.slider("Maximum Speed (km/h)", 10, 60, 60)
 min_speed = st.sidebar.slider("Minimum Speed (km/h)", 10, 60, 10)
 driver_type = st.sidebar.selectbox("Driver Behavior", ["Cautious", "Average", "Aggressive"])
+sim_speed = st.sidebar.slider("Sim speed ×", 1, 50, 1)
 start_sim = st.sidebar.button("▶ Start Simulation")
 
 # -------------------- DRIVER BEHAVIOR --------------------
+# Driver types map to proportional-controller gains: how hard the driver
+# tracks the advisory speed each tick (replaces the old random "follows
+# advice" coin flip).
 driver_profiles = {
-    "Cautious": 0.9,
-    "Average": 0.7,
-    "Aggressive": 0.4
+    "Cautious": 0.05,
+    "Average": 0.1,
+    "Aggressive": 0.2
 }
-driver_prob = driver_profiles[driver_type]
-
-# -------------------- TRAFFIC LIGHTS --------------------
-signal_positions = [150, 350, 550, 750, 950]
-signal_labels = ['B', 'C', 'D', 'E', 'F']
-traffic_lights = {}
-phase_cycle = [("red", 40), ("green", 45), ("yellow", 5)]
-
-# INIT
-for label, pos in zip(signal_labels, signal_positions):
-    phase = random.choice(['red', 'green', 'yellow'])
-    timer = 5 if phase == 'yellow' else random.randint(30, 60)
-    traffic_lights[label] = {
-        "x": pos,
-        "phase": phase,
-        "timer": timer,
-        "start_time": time.time()
-    }
+params = Params(
+    kp=driver_profiles[driver_type],
+    init_speed=float(init_speed),
+    min_speed=float(min_speed),
+    max_speed=float(max_speed),
+)
 
 # -------------------- SESSION STATE --------------------
-car_pos = 0.0
-car_speed = float(init_speed)
-waiting = False
-waiting_signal = None
+# Signal state is a precomputed schedule: each run draws a seed, and the
+# whole (phase, timer) trajectory comes from the disk-cached build_schedule.
+# The only per-tick signal work is a row lookup, and a run replays
+# deterministically from its seed.
+if "car_pos" not in st.session_state:
+    st.session_state.car_pos = 0.0
+    st.session_state.car_speed = params.init_speed
+    st.session_state.waiting_idx = -1
+    st.session_state.sig_cursor = 0
+    st.session_state.seed = 0
+    st.session_state.tick = 0
+    st.session_state.running = False
 
 if "prev_prediction" not in st.session_state:
     st.session_state.prev_prediction = None
 if "last_voice_time" not in st.session_state:
     st.session_state.last_voice_time = 0.0
 
-info_box = st.empty()
-road_box = st.empty()
-
-# -------------------- FUNCTIONS --------------------
-def update_signals():
-    for sig in traffic_lights.values():
-        if time.time() - sig["start_time"] >= sig["timer"]:
-            i = next(i for i, (ph, _) in enumerate(phase_cycle) if ph == sig["phase"])
-            next_i = (i + 1) % len(phase_cycle)
-            next_phase, duration = phase_cycle[next_i]
-            sig["phase"] = next_phase
-            sig["timer"] = duration
-            sig["start_time"] = time.time()
-
-def predict_phase_at_arrival(signal, eta):
-    elapsed = time.time() - signal["start_time"]
-    offset = elapsed + eta
-    total_cycle = sum(d for _, d in phase_cycle)
-    t = offset % total_cycle
-    accum = 0
-    for phase, duration in phase_cycle:
-        accum += duration
-        if t < accum:
-            return phase
-    return phase_cycle[-1][0]
-
-def calculate_required_speed(distance, time_left):
-    return (distance / time_left) * 10 if time_left > 0 else float('inf')
-
-# -------------------- SIMULATION LOOP --------------------
+# Advice hysteresis packed into one int: low nibble is the advice code, the
+# rest is how many consecutive ticks it has held. Advice is only surfaced
+# once it has been stable for two ticks, and the whole update is integer
+# arithmetic on a single session-state key.
+if "advice_state" not in st.session_state:
+    st.session_state.advice_state = MAINTAIN | (1 << 4)
+
+# -------------------- VOICE ALERTS --------------------
+# A __speak helper is installed on the top-level window once per session;
+# each alert then posts a one-line call instead of a full SpeechSynthesis
+# script block. Payloads go through json.dumps, so quotes in an utterance
+# can never break out of the script.
+VOICE_LINES = {
+    "Speed Up": "Green signal ahead. Speed up.",
+    "Slow Down": "Red signal ahead. Please slow down.",
+    "Stop": "Stopping at red signal.",
+    "Maintain": "Maintain your speed."
+}
+
+if "speak_injected" not in st.session_state:
+    components.html(
+        '<script>'
+        'window.parent.__speak = function (m) {'
+        'window.parent.speechSynthesis.cancel();'
+        'window.parent.speechSynthesis.speak(new SpeechSynthesisUtterance(m));'
+        '};'
+        '</script>', height=0)
+    st.session_state.speak_injected = True
+
+# Precompiled at import: per alert only the JSON-escaped utterance is
+# substituted into the invariant script shell.
+_VOICE_TPL = string.Template('<script>parent.__speak($v);</script>')
+
+@st.cache_data
+def _voice_html(text: str) -> str:
+    return _VOICE_TPL.substitute(v=json.dumps(text))
+
+# -------------------- SIMULATION (one tick per fragment run) --------------------
+# A fragment with run_every drives the cadence: only the fragment reruns each
+# second, so ticks stream frame deltas without re-executing the whole script,
+# and the sidebar stays live instead of being blocked by a while/sleep loop.
 if start_sim:
-    while car_pos <= 1100:
-        update_signals()
-        driver_follows = random.random() < driver_prob
-
-        next_signal = None
-        for label in signal_labels:
-            if traffic_lights[label]["x"] > car_pos:
-                next_signal = label
-                break
-
-        suggestion = "Maintain"
-        eta = float('inf')
-        distance = 0
-        predicted = "-"
-        current_phase = "-"
-
-        if next_signal:
-            sig = traffic_lights[next_signal]
-            distance = sig["x"] - car_pos
-            current_phase = sig["phase"]
-            eta = distance / (car_speed * 0.1) if car_speed > 0 else float('inf')
-            predicted = predict_phase_at_arrival(sig, eta)
-
-            if predicted == "green":
-                green_left = sig["timer"] - (time.time() - sig["start_time"])
-                req_speed = calculate_required_speed(distance, green_left)
-                if eta <= green_left and req_speed <= max_speed:
-                    suggestion = "Speed Up"
-                    if driver_follows and car_speed < max_speed:
-                        car_speed += 2
-                else:
-                    suggestion = "Maintain"
-
-            elif predicted == "red":
-                red_left = sig["timer"] - (time.time() - sig["start_time"])
-                time_after_red = eta - red_left
-                if 0 < time_after_red <= 45:
-                    req_speed = calculate_required_speed(distance, time_after_red)
-                    if req_speed <= max_speed:
-                        suggestion = "Speed Up"
-                        if driver_follows and car_speed < max_speed:
-                            car_speed += 2
-                    else:
-                        suggestion = "Maintain"
-                else:
-                    suggestion = "Slow Down"
-                    if driver_follows and car_speed > min_speed:
-                        car_speed -= 2
-
-            elif predicted == "yellow":
-                suggestion = "Slow Down"
-                if driver_follows and car_speed > min_speed:
-                    car_speed -= 2
-
-            if current_phase == "red" and distance <= 40:
-                suggestion = "Stop"
-                car_speed = 0
-                waiting = True
-                waiting_signal = next_signal
-
-        if waiting and waiting_signal:
-            if traffic_lights[waiting_signal]["phase"] == "green":
-                waiting = False
-                car_speed = 15
-
-        now = time.time()
-        if (st.session_state.prev_prediction != predicted) and (now - st.session_state.last_voice_time > 5):
-            voice_text = {
-                "Speed Up": "Green signal ahead. Speed up.",
-                "Slow Down": "Red signal ahead. Please slow down.",
-                "Stop": "Stopping at red signal.",
-                "Maintain": "Maintain your speed."
-            }.get(suggestion, "")
-            if voice_text:
-                components.html(f"""
-                <script>
-                var msg = new SpeechSynthesisUtterance("{voice_text}");
-                window.speechSynthesis.cancel();
-                window.speechSynthesis.speak(msg);
-                </script>
-                """, height=0)
-                st.session_state.prev_prediction = predicted
-                st.session_state.last_voice_time = now
-
-        if car_speed > 0:
-            car_pos += car_speed * 0.1
-
-        eta_str = "Waiting" if math.isinf(eta) else f"{int(eta)}s"
-        info_box.markdown(f"""
-        ### 🚘 Vehicle Info
-        - **Speed:** {int(car_speed)} km/h
-        - **Next Signal:** {next_signal or "None"}
-        - **Distance to Signal:** {int(distance)} px
-        - **Current Signal Phase:** {current_phase}
-        - **ETA to Signal:** {eta_str}
-        - **Predicted Phase on Arrival:** {predicted}
-        - **Suggestion:** **{suggestion}**
-        """)
-
-        road = ["—"] * 120
-        for label in signal_labels:
-            idx = int(traffic_lights[label]["x"] / 10)
-            phase = traffic_lights[label]["phase"]
-            road[idx] = {"red": "🔳", "green": "🟢", "yellow": "🔶"}[phase]
-        car_idx = int(car_pos / 10)
-        if 0 <= car_idx < len(road):
-            road[car_idx] = "🔵"
-        road_box.markdown("### 🚳️ Road View")
-        road_box.code("".join(road))
-
-        time.sleep(1)
+    st.session_state.seed = int(np.random.default_rng().integers(2**31))
+    st.session_state.tick = 0
+    st.session_state.car_pos = 0.0
+    st.session_state.car_speed = params.init_speed
+    st.session_state.waiting_idx = -1
+    st.session_state.sig_cursor = 0
+    st.session_state.running = True
+
+@st.fragment(run_every="1s" if st.session_state.running else None)
+def tick():
+    if not st.session_state.running:
+        # A fragment rerun replaces the previous fragment output, so an idle
+        # wakeup (the client timer can fire once more after a run ends) must
+        # redraw rather than return empty, or the last frame would blank.
+        cached = st.session_state.get("last_frame")
+        if cached is not None:
+            st.empty().markdown(cached, unsafe_allow_html=True)
+        if st.session_state.car_pos > 1100:
+            st.success("🏁 Simulation complete.")
+        return
+
+    # Placeholders live inside the fragment: one markdown render batches the
+    # info block, road view and signal row into a single delta per tick.
+    frame_box = st.empty()
+
+    # Session-state attribute access goes through a lock and a dict lookup;
+    # bind everything the tick touches to locals up front and write back only
+    # the keys that changed.
+    car_pos = st.session_state.car_pos
+    car_speed = st.session_state.car_speed
+    waiting_idx = st.session_state.waiting_idx
+    sig_cursor = st.session_state.sig_cursor
+    tick_no = st.session_state.tick
+    prev_prediction = st.session_state.prev_prediction
+    last_voice_time = st.session_state.last_voice_time
+
+    sched_phases, sched_timers = build_schedule(st.session_state.seed)
+    last_row = sched_phases.shape[0] - 1
+
+    # Advance the (cheap, JIT-compiled) simulation several ticks per frame;
+    # the render and its protobuf round-trip happen once regardless of the
+    # multiplier.
+    for _ in range(sim_speed):
+        phases = sched_phases[min(tick_no, last_row)]
+        timers = sched_timers[min(tick_no, last_row)]
+        (car_pos, car_speed, waiting_idx, next_idx,
+         eta, distance, predicted_code, suggestion_code, sig_cursor) = step(
+            car_pos, car_speed, timers, phases, POSITIONS,
+            params.kp, params.min_speed, params.max_speed, waiting_idx, sig_cursor)
+        tick_no += 1
+        if car_pos > 1100:
+            break
+
+    advice_state = st.session_state.advice_state
+    code = advice_state & 0xF
+    cnt = advice_state >> 4
+    if suggestion_code == code:
+        cnt = min(cnt + 1, 15)
+    else:
+        code, cnt = suggestion_code, 1
+    advice_state = code | (cnt << 4)
+    stable_code = code if cnt >= 2 else MAINTAIN
+
+    suggestion = SUGGESTION_NAMES[stable_code]
+    predicted = PHASE_NAMES[predicted_code] if predicted_code >= 0 else "-"
+
+    now = time.time()
+    if (prev_prediction != predicted) and (now - last_voice_time > 5):
+        voice_text = VOICE_LINES.get(suggestion, "")
+        if voice_text:
+            components.html(_voice_html(voice_text), height=0)
+            prev_prediction = predicted
+            last_voice_time = now
+
+    render(frame_box, car_pos, car_speed, next_idx, eta, distance,
+           predicted_code, stable_code, phases, timers)
+
+    st.session_state.car_pos = car_pos
+    st.session_state.car_speed = car_speed
+    st.session_state.tick = tick_no
+    if waiting_idx != st.session_state.waiting_idx:
+        st.session_state.waiting_idx = waiting_idx
+    if sig_cursor != st.session_state.sig_cursor:
+        st.session_state.sig_cursor = sig_cursor
+    if advice_state != st.session_state.advice_state:
+        st.session_state.advice_state = advice_state
+    if prev_prediction != st.session_state.prev_prediction:
+        st.session_state.prev_prediction = prev_prediction
+    if last_voice_time != st.session_state.last_voice_time:
+        st.session_state.last_voice_time = last_voice_time
+
+    if car_pos > 1100:
+        st.session_state.running = False
+        # run_every is baked into the client timer until the next full run;
+        # rerun the whole app so the fragment re-decorates with run_every=None
+        # and the timer stops. The idle path above re-posts the final frame
+        # and the completion message.
+        st.rerun(scope="app")
+
+tick()
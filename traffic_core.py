@@ -0,0 +1,255 @@
+"""Shared simulation core for the traffic optimizer apps.
+
+Lookup tables, Numba kernels and render templates live here so an entry
+point like app.py only wires up widgets, session state and its tuning
+(Params). Variants of the simulation share one cached Numba compile.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import streamlit as st
+from numba import njit
+
+# -------------------- PHASE / SUGGESTION CODES --------------------
+# Signal state lives in parallel arrays (structure-of-arrays) instead of a
+# dict of per-light dicts, so one vectorized pass updates every light per tick.
+RED, GREEN, YELLOW = 0, 1, 2
+PHASE_NAMES = ("red", "green", "yellow")
+SIGNAL_LABELS = ('B', 'C', 'D', 'E', 'F')
+
+# Nominal phase lengths as module-level constants: the prediction compares
+# fold to immediates under Numba, and CPython's specializing interpreter can
+# treat them as stable globals.
+RED_DUR, GREEN_DUR, YELLOW_DUR = 40, 45, 5
+CYCLE_LEN = RED_DUR + GREEN_DUR + YELLOW_DUR
+
+# Suggestions use the same integer-code scheme so the whole step stays
+# type-stable under Numba (no strings inside @njit).
+MAINTAIN, SPEED_UP, SLOW_DOWN, STOP = 0, 1, 2, 3
+SUGGESTION_NAMES = ("Maintain", "Speed Up", "Slow Down", "Stop")
+
+# -------------------- RENDER TEMPLATES --------------------
+# Road view is an SVG strip instead of a 120-emoji string: the browser
+# composites a handful of circles rather than reflowing a <pre> of emoji,
+# and the payload is positions, not glyphs. The signal circles only change
+# on a phase flip, so they are cached per phase combination.
+PHASE_FILL = ("#ff4136", "#2ecc40", "#ffb700")
+ROAD_SVG = ('<svg width="100%" height="40" viewBox="0 0 1120 40">'
+            '<line x1="0" y1="30" x2="1120" y2="30" stroke="#888" stroke-width="2"/>'
+            '{signals}'
+            '<circle cx="{car}" cy="30" r="6" fill="#0074d9"/>'
+            '</svg>')
+
+@st.cache_data
+def _signal_circles(phase_key):
+    return "".join(
+        f'<circle cx="{int(POSITIONS[i])}" cy="20" r="8" fill="{PHASE_FILL[p]}"/>'
+        for i, p in enumerate(phase_key))
+
+# "No ETA" sentinel: a large finite float is cheaper to test (one compare)
+# than float('inf') plus math.isinf in the render path, and stays valid
+# arithmetic inside the Numba kernel.
+ETA_INF = 1e9
+
+# Per-signal states render as one HTML flex row inside the frame — a single
+# markdown delta instead of per-signal widgets (st.columns/st.metric would
+# post a protobuf message each, every tick).
+PHASE_ICONS = ("🔳", "🟢", "🔶")
+METRIC_CELL = '<div style="flex:1;text-align:center"><b>Signal {label}</b><br><span style="font-size:1.5em">{icon}</span><br>{timer}s</div>'
+
+INFO_TEMPLATE = """
+### 🚘 Vehicle Info
+- **Speed:** {speed} km/h
+- **Next Signal:** {signal}
+- **Distance to Signal:** {distance} px
+- **Current Signal Phase:** {phase}
+- **ETA to Signal:** {eta}
+- **Predicted Phase on Arrival:** {predicted}
+- **Suggestion:** **{suggestion}**
+
+### 🚳️ Road View
+{road}
+
+<div style="display:flex;gap:1em">{metrics}</div>
+"""
+
+# -------------------- CONSTANT TABLES --------------------
+@st.cache_resource
+def signal_constants():
+    # Constant lookup tables, built once per server process instead of on
+    # every script rerun.
+    return {
+        "positions": np.array([150, 350, 550, 750, 950], dtype=np.int32),
+        "next_phase": np.array([GREEN, YELLOW, RED], dtype=np.uint8),       # red→green, green→yellow, yellow→red
+        "next_duration_fixed": np.array([-1, GREEN_DUR, YELLOW_DUR], dtype=np.int32),  # -1: red duration is drawn at random
+        "phase_durations": np.array([RED_DUR, GREEN_DUR, YELLOW_DUR], dtype=np.int32),
+        "phase_start": np.array([0, RED_DUR, RED_DUR + GREEN_DUR], dtype=np.int32),
+    }
+
+_consts = signal_constants()
+POSITIONS = _consts["positions"]
+NEXT_PHASE = _consts["next_phase"]
+NEXT_DURATION_FIXED = _consts["next_duration_fixed"]
+PHASE_DURATIONS = _consts["phase_durations"]
+PHASE_START = _consts["phase_start"]
+
+@st.cache_data(persist="disk")
+def build_schedule(seed: int, T: int = 2000):
+    """Precompute (phases, timers) per signal for T ticks.
+
+    The signal process is independent of the car, so the whole trajectory is
+    known up front given a seed. Red lengths come out of the generator in
+    batches, the per-tick signal update collapses to one row lookup, and a
+    run replays deterministically from its seed.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(POSITIONS)
+    phases = np.empty((T, n), dtype=np.uint8)
+    timers = np.empty((T, n), dtype=np.int32)
+    ph = rng.integers(0, 3, n).astype(np.uint8)
+    tm = np.where(ph == YELLOW, 5, rng.integers(30, 61, n)).astype(np.int32)
+    for t in range(T):
+        tm -= 1
+        expired = tm <= 0
+        if expired.any():
+            new = NEXT_PHASE[ph[expired]]
+            ph[expired] = new
+            fixed = NEXT_DURATION_FIXED[new]
+            tm[expired] = np.where(fixed >= 0, fixed,
+                                   rng.integers(30, 61, fixed.shape[0]))
+        phases[t] = ph
+        timers[t] = tm
+    return phases, timers
+
+# -------------------- TUNING --------------------
+@dataclass
+class Params:
+    """Per-entry-point tuning for the simulation."""
+    kp: float = 0.1
+    init_speed: float = 25.0
+    min_speed: float = 10.0
+    max_speed: float = 60.0
+
+# -------------------- KERNELS --------------------
+@njit(cache=True, fastmath=True)
+def predict_phase_at(phase, timer, eta):
+    # Closed-form: place the arrival on the nominal red→green→yellow cycle and
+    # read the phase off with one modulo and two compares (no per-phase walk).
+    # The duration constants fold into compare immediates at compile time.
+    if eta >= ETA_INF:
+        return phase
+    elapsed_in_phase = PHASE_DURATIONS[phase] - timer
+    t = (PHASE_START[phase] + elapsed_in_phase + int(eta)) % CYCLE_LEN
+    if t < RED_DUR:
+        return RED
+    if t < RED_DUR + GREEN_DUR:
+        return GREEN
+    return YELLOW
+
+@njit(cache=True, fastmath=True)
+def best_speed(distance, timer, phase, v_min, v_max, cruise, n=16):
+    # Receding-horizon lookahead: score n candidate speeds by the phase each
+    # one lands on (green beats yellow beats red) with a small penalty for
+    # straying from the current cruise speed, and return the best. The JIT
+    # predictor makes the whole grid scan cost well under a microsecond.
+    best = cruise
+    best_score = ETA_INF
+    span = (v_max - v_min) / (n - 1)
+    for k in range(n):
+        v = v_min + span * k
+        eta = distance / (v * 0.1)
+        p = predict_phase_at(phase, timer, eta)
+        if p == GREEN:
+            score = 0.0
+        elif p == YELLOW:
+            score = 10.0
+        else:
+            score = 100.0
+        score += abs(v - cruise)
+        if score < best_score:
+            best = v
+            best_score = score
+    return best
+
+@njit(cache=True, fastmath=True)
+def step(car_pos, car_speed, timers, phases, positions,
+         kp, min_speed, max_speed, waiting_idx, cursor):
+    # One simulated second: next-signal search, ETA/prediction, speed advice
+    # and car integration over the precomputed signal row for this tick.
+    # The car only moves forward, so the next-signal cursor advances
+    # monotonically — O(1) amortized over a run, no search per tick.
+    n = positions.shape[0]
+    while cursor < n and positions[cursor] <= car_pos:
+        cursor += 1
+    next_idx = cursor if cursor < n else -1
+
+    suggestion = MAINTAIN
+    eta = ETA_INF
+    distance = 0.0
+    predicted = -1
+
+    if next_idx >= 0:
+        distance = positions[next_idx] - car_pos
+        eta = distance / (car_speed * 0.1) if car_speed > 0 else ETA_INF
+        predicted = predict_phase_at(phases[next_idx], timers[next_idx], eta)
+
+        # Pick a target speed by scoring candidates over the horizon, then
+        # track it with the deterministic P-controller: one multiply-add per
+        # tick, clamped to the speed limits.
+        target = best_speed(distance, timers[next_idx], phases[next_idx],
+                            min_speed, max_speed, car_speed)
+        if target > car_speed + 1.0:
+            suggestion = SPEED_UP
+        elif target < car_speed - 1.0:
+            suggestion = SLOW_DOWN
+        car_speed += kp * (target - car_speed)
+        car_speed = min(max(car_speed, min_speed), max_speed)
+
+        if phases[next_idx] == RED and distance <= 40:
+            suggestion = STOP
+            car_speed = 0.0
+            waiting_idx = next_idx
+
+    if waiting_idx >= 0 and phases[waiting_idx] == GREEN:
+        waiting_idx = -1
+        car_speed = 15.0
+
+    if car_speed > 0:
+        car_pos += car_speed * 0.1
+
+    return car_pos, car_speed, waiting_idx, next_idx, eta, distance, predicted, suggestion, cursor
+
+# Warm-up call so the (cached) JIT compile happens at import, not mid-simulation.
+step(0.0, 0.0, np.ones_like(POSITIONS), np.zeros(len(POSITIONS), np.uint8), POSITIONS,
+     0.1, 10.0, 60.0, -1, 0)
+
+# -------------------- RENDER --------------------
+def render(frame_box, car_pos, car_speed, next_idx, eta, distance,
+           predicted_code, suggestion_code, phases, timers):
+    """Post one frame (info block, road view, signal row) as a single delta.
+
+    The built markdown is kept in st.session_state.last_frame so the entry
+    point can re-post it on idle fragment wakeups after a run ends.
+    """
+    road_str = ROAD_SVG.format(
+        signals=_signal_circles(tuple(int(p) for p in phases)),
+        car=min(1120, int(car_pos)))
+
+    metrics_row = "".join(
+        METRIC_CELL.format(label=SIGNAL_LABELS[i], icon=PHASE_ICONS[phases[i]], timer=timers[i])
+        for i in range(len(POSITIONS)))
+
+    body = INFO_TEMPLATE.format_map({
+        "speed": int(car_speed),
+        "signal": SIGNAL_LABELS[next_idx] if next_idx >= 0 else "None",
+        "distance": int(distance),
+        "phase": PHASE_NAMES[phases[next_idx]] if next_idx >= 0 else "-",
+        "eta": "Waiting" if eta >= ETA_INF else f"{int(eta)}s",
+        "predicted": PHASE_NAMES[predicted_code] if predicted_code >= 0 else "-",
+        "suggestion": SUGGESTION_NAMES[suggestion_code],
+        "road": road_str,
+        "metrics": metrics_row,
+    })
+    st.session_state.last_frame = body
+    frame_box.markdown(body, unsafe_allow_html=True)